@@ -0,0 +1,31 @@
+import multiprocessing
+import os
+
+bind = "0.0.0.0:8081"
+# One uvicorn worker (and so one event loop) per core by default
+workers = int(os.getenv("WEB_CONCURRENCY", multiprocessing.cpu_count()))
+worker_class = "uvicorn_worker.UvicornWorker"
+backlog = 4096
+
+# Number of live workers pinned to each CPU, tracked in the master process
+cpu_usage = {}
+
+
+def pre_fork(server, worker):
+    # Pick the least used CPU, so a restarted worker takes over the core its
+    # predecessor freed rather than doubling up on a busy one
+    if hasattr(os, "sched_setaffinity"):
+        cpus = sorted(os.sched_getaffinity(0))
+        worker.cpu = min(cpus, key=lambda cpu: cpu_usage.get(cpu, 0))
+        cpu_usage[worker.cpu] = cpu_usage.get(worker.cpu, 0) + 1
+
+
+def post_fork(server, worker):
+    # Pin the worker to its CPU so its event loop isn't moved between cores
+    if hasattr(worker, "cpu"):
+        os.sched_setaffinity(0, {worker.cpu})
+
+
+def child_exit(server, worker):
+    if hasattr(worker, "cpu"):
+        cpu_usage[worker.cpu] -= 1
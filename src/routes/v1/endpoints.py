@@ -1,47 +1,175 @@
 from fastapi import APIRouter, WebSocket, WebSocketDisconnect, HTTPException, UploadFile, File, Form
 from fastapi.responses import JSONResponse
-import json
+import orjson
+import re
 import time
 import asyncio
 import os
 import base64
-from typing import List, Dict, Union
+from typing import List, Dict, Optional, Union
 from openai import AsyncOpenAI
 from pydantic import BaseModel
 from nltk.sentiment.vader import SentimentIntensityAnalyzer
 
+from src.settings import settings
+from src.utils.app_resources import http_client, redis_client
+
 router = APIRouter()
 
+# Redis channel used to relay broadcasts between workers
+BROADCAST_CHANNEL = "chat:broadcast"
+
+# Nothing broadcasts yet, so workers only subscribe to the channel when this
+# is enabled; otherwise broadcasts reach this worker's clients only
+BROADCAST_RELAY = settings.REDIS_BROADCAST
+
+# Maximum number of frames waiting to be sent to a single client
+SEND_QUEUE_SIZE = 64
+
+# Seconds to wait before resubscribing after the broadcast relay fails,
+# doubled after each consecutive failure up to RELAY_MAX_RETRY_DELAY
+RELAY_RETRY_DELAY = 1.0
+RELAY_MAX_RETRY_DELAY = 30.0
+
 # Connection manager for WebSockets
 class ConnectionManager:
     def __init__(self):
         self.active_connections: Dict[str, WebSocket] = {}
+        # Outgoing messages per client, drained in order by that client's writer task
+        self.send_queues: Dict[str, asyncio.Queue] = {}
+        self.writer_tasks: Dict[str, asyncio.Task] = {}
+        # Relays broadcasts from other workers while this one has clients
+        self.relay_task: Optional[asyncio.Task] = None
 
     async def connect(self, websocket: WebSocket, client_id: str):
         await websocket.accept()
+        # A reconnect replaces any previous connection for the same client
+        self.release_connection(client_id)
+        queue = asyncio.Queue(maxsize=SEND_QUEUE_SIZE)
         self.active_connections[client_id] = websocket
-
-    def disconnect(self, client_id: str):
+        self.send_queues[client_id] = queue
+        self.writer_tasks[client_id] = asyncio.create_task(
+            self.write_messages(websocket, queue, client_id)
+        )
+        if self.relays_broadcasts() and self.relay_task is None:
+            self.relay_task = asyncio.create_task(self.relay_broadcasts())
+
+    def disconnect(self, client_id: str, websocket: Optional[WebSocket] = None):
+        # A connection that has since been replaced by a reconnect of the same
+        # client must not remove the new one
+        if websocket is not None and self.active_connections.get(client_id) is not websocket:
+            return
+        self.release_connection(client_id)
+        if not self.active_connections and self.relay_task is not None:
+            self.relay_task.cancel()
+            self.relay_task = None
+
+    def release_connection(self, client_id: str):
+        """Stop the client's writer and drop its connection and queue"""
         if client_id in self.active_connections:
             del self.active_connections[client_id]
+            self.writer_tasks.pop(client_id).cancel()
+            # Empty the queue so producers blocked on a full queue are released
+            queue = self.send_queues.pop(client_id)
+            while not queue.empty():
+                queue.get_nowait()
 
     async def send_message(self, message: str, client_id: str):
-        if client_id in self.active_connections:
-            await self.active_connections[client_id].send_text(message)
-
-    async def broadcast(self, message: str):
-        for connection in self.active_connections.values():
-            await connection.send_text(message)
+        # Queue the message for the client's writer; once the queue is full this
+        # waits, so a slow client throttles its producer instead of growing memory
+        if client_id in self.send_queues:
+            await self.send_queues[client_id].put(message)
+
+    async def write_messages(self, websocket: WebSocket, queue: asyncio.Queue, client_id: str):
+        """Send queued messages to a client one at a time, in order"""
+        try:
+            while True:
+                message = await queue.get()
+                await websocket.send_text(message)
+        except Exception as e:
+            print(f"Error sending to websocket: {str(e)}")
+            self.disconnect(client_id, websocket)
+
+    def relays_broadcasts(self) -> bool:
+        return redis_client is not None and BROADCAST_RELAY
+
+    async def broadcast(self, message: Union[str, Dict]):
+        # Encode once for every receiver
+        payload = message if isinstance(message, str) else orjson.dumps(message).decode()
+        if self.relays_broadcasts():
+            # Every worker, this one included, relays it to its own clients
+            await redis_client.publish(BROADCAST_CHANNEL, payload)
+        else:
+            await self.broadcast_local(payload)
+
+    async def broadcast_local(self, payload: str):
+        # Snapshot the queues so disconnects during the fan-out are safe; each
+        # client's writer then delivers at that client's own pace
+        for client_id, queue in list(self.send_queues.items()):
+            try:
+                queue.put_nowait(payload)
+            except asyncio.QueueFull:
+                # Never wait on a stalled client; it misses this broadcast instead
+                print(f"Dropping broadcast for {client_id}: send queue is full")
+
+    async def relay_broadcasts(self):
+        """Forward broadcasts published by any worker to this worker's clients"""
+        delay = RELAY_RETRY_DELAY
+        while True:
+            try:
+                async with redis_client.pubsub() as pubsub:
+                    await pubsub.subscribe(BROADCAST_CHANNEL)
+                    delay = RELAY_RETRY_DELAY
+                    async for message in pubsub.listen():
+                        if message["type"] == "message":
+                            await self.broadcast_local(message["data"].decode())
+            except Exception as e:
+                # Keep relaying for connected clients once Redis is reachable
+                # again, backing off so an outage is not retried every second
+                print(f"Error relaying broadcasts, retrying in {delay:g}s: {str(e)}")
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, RELAY_MAX_RETRY_DELAY)
 
 manager = ConnectionManager()
 
+# Frames whose content never changes are encoded once at import time
+FEEDBACK_RECEIVED_FRAME = orjson.dumps({"type": "feedback_received"}).decode()
+
+# Streamed deltas are coalesced and flushed once this many characters are
+# buffered, or after STREAM_FLUSH_INTERVAL seconds without a flush.
+STREAM_FLUSH_SIZE = 8192
+STREAM_FLUSH_INTERVAL = 0.025
+
+class StreamBuffer:
+    """Accumulates streamed deltas so they can be sent as a single frame."""
+    def __init__(self, max_size: int = STREAM_FLUSH_SIZE):
+        self.parts: List[str] = []
+        self.size = 0
+        self.max_size = max_size
+
+    def __bool__(self) -> bool:
+        return self.size > 0
+
+    def append(self, chunk: str):
+        self.parts.append(chunk)
+        self.size += len(chunk)
+
+    def is_full(self) -> bool:
+        return self.size >= self.max_size
+
+    def drain(self) -> str:
+        text = "".join(self.parts)
+        self.parts.clear()
+        self.size = 0
+        return text
+
 # Load OpenAI API key from environment
 openai_api_key = os.getenv("OPENAI_API_KEY")
 if not openai_api_key:
     raise ValueError("Missing OPENAI_API_KEY environment variable")
 
 # Initialize the OpenAI client
-client = AsyncOpenAI(api_key=openai_api_key)
+client = AsyncOpenAI(api_key=openai_api_key, http_client=http_client)
 
 # Initialize VADER sentiment analyzer
 try:
@@ -59,32 +187,92 @@ except:
         sentiment_analyzer = None
 
 # Models
-class Message(BaseModel):
-    role: str
-    content: Union[str, List[Dict]]
-
 class ChatSession(BaseModel):
     id: str
-    messages: List[Message] = []
+    # Messages are kept in the shape the OpenAI API expects, i.e.
+    # {"role": ..., "content": ...}, so the history can be sent as is
+    messages: List[Dict] = []
 
-# In-memory storage for chat sessions
+# In-memory storage for chat sessions. When Redis is configured it is the
+# source of truth and this only holds sessions connected to this worker.
 chat_sessions: Dict[str, ChatSession] = {}
 
+# Sessions stored in Redis expire after this many seconds without new messages
+SESSION_TTL = 3600
+
+# Maximum number of messages kept per session, and so sent to OpenAI per turn
+MAX_HISTORY = 32
+
+def append_message(messages: List[Dict], message: Dict):
+    """
+    Append a message to a session history, dropping the oldest messages once the
+    history exceeds MAX_HISTORY. A leading system message is always kept.
+    """
+    messages.append(message)
+    if len(messages) > MAX_HISTORY:
+        start = 1 if messages[0]["role"] == "system" else 0
+        del messages[start:len(messages) - MAX_HISTORY + start]
+
+def session_key(client_id: str) -> str:
+    return f"chat:{client_id}"
+
+async def load_session(client_id: str) -> Optional[ChatSession]:
+    """Load a chat session from Redis if configured, otherwise from memory"""
+    if redis_client is None:
+        return chat_sessions.get(client_id)
+
+    messages = await redis_client.lrange(session_key(client_id), -MAX_HISTORY, -1)
+    if not messages:
+        return None
+    # The stored messages were written by us, so skip re-validating them
+    return ChatSession.model_construct(id=client_id, messages=[orjson.loads(m) for m in messages])
+
+async def save_message(client_id: str, messages: List[Dict], message: Dict):
+    """
+    Persist a message to Redis if configured, then append it to the session
+    history. If the Redis write fails the error is raised and the history is
+    left unchanged, so the two never diverge.
+    """
+    if redis_client is not None:
+        key = session_key(client_id)
+        await (
+            redis_client.pipeline(transaction=False)
+            .rpush(key, orjson.dumps(message))
+            .ltrim(key, -MAX_HISTORY, -1)
+            .expire(key, SESSION_TTL)
+            .execute()
+        )
+    append_message(messages, message)
+
 @router.websocket("/ws/{client_id}")
 async def websocket_endpoint(websocket: WebSocket, client_id: str):
     await manager.connect(websocket, client_id)
-
-    # Initialize chat session if it doesn't exist
-    if client_id not in chat_sessions:
-        chat_sessions[client_id] = ChatSession(id=client_id, messages=[])
+    session = None
 
     try:
+        # Initialize chat session if it doesn't exist. This is inside the try so
+        # a failed Redis read still goes through the disconnect cleanup below.
+        if client_id not in chat_sessions:
+            loaded = await load_session(client_id)
+            chat_sessions[client_id] = loaded or ChatSession.model_construct(id=client_id, messages=[])
+        session = chat_sessions[client_id]
+
         while True:
-            data = await websocket.receive_text()
-            message_data = json.loads(data)
+            message = await websocket.receive()
+            if message["type"] == "websocket.disconnect":
+                raise WebSocketDisconnect(message.get("code", 1000))
+
+            # Clients may send JSON as text or binary frames; binary frames are
+            # parsed directly without decoding them to a string first
+            if message.get("bytes") is not None:
+                message_data = orjson.loads(message["bytes"])
+            else:
+                message_data = orjson.loads(message["text"])
 
             # Handle different message types
             if message_data.get("type") == "message":
+                # History list for this session; it is sent to OpenAI as is
+                history = chat_sessions[client_id].messages
                 user_message = message_data.get("content", "")
                 image_data = message_data.get("image")
 
@@ -103,77 +291,75 @@ async def websocket_endpoint(websocket: WebSocket, client_id: str):
                             "detail": "high"
                         }
                     })
-                    
-                    # Add user message with image to session history
-                    chat_sessions[client_id].messages.append(
-                        Message(role="user", content=message_content)
-                    )
                 else:
                     # Regular text message
-                    chat_sessions[client_id].messages.append(
-                        Message(role="user", content=user_message)
+                    message_content = user_message
+
+                # Add user message to session history
+                try:
+                    await save_message(
+                        client_id, history, {"role": "user", "content": message_content}
                     )
+                except Exception as e:
+                    # Without the message in history there is nothing to reply to
+                    error_data = {
+                        "type": "error",
+                        "content": f"Error saving message: {str(e)}",
+                    }
+                    await manager.send_message(orjson.dumps(error_data).decode(), client_id)
+                    continue
 
                 # Start response time measurement
-                start_time = time.time()
+                start_time = time.perf_counter()
 
                 try:
                     # For non-streaming response
                     if not message_data.get("stream", False):
                         # Call OpenAI API
-                        response = await get_ai_response(chat_sessions[client_id].messages, image_data is not None)
+                        response = await get_ai_response(history, image_data is not None)
 
                         # Calculate response time
-                        response_time = time.time() - start_time
+                        response_time = time.perf_counter() - start_time
 
                         # Add AI response to session history
-                        chat_sessions[client_id].messages.append(
-                            Message(role="assistant", content=response)
+                        await save_message(
+                            client_id, history, {"role": "assistant", "content": response}
                         )
 
                         # Send response with metadata
                         response_data = {
                             "type": "message",
                             "content": response,
-                            "metadata": {
-                                "response_time": response_time,
-                                "length": len(response),
-                                "sentiment": analyze_sentiment(response),
-                                "contains_image_analysis": image_data is not None,
-                            },
+                            "metadata": build_response_metadata(response_time, response, image_data is not None),
                         }
-                        await manager.send_message(json.dumps(response_data), client_id)
+                        await manager.send_message(orjson.dumps(response_data).decode(), client_id)
 
                     # For streaming response
                     else:
-                        # Create a variable to accumulate the complete response
-                        complete_response = ""
+                        # Collect the streamed pieces and join them once at the end
+                        parts: List[str] = []
                         
-                        async for chunk in stream_ai_response(chat_sessions[client_id].messages, image_data is not None):
+                        async for text in buffered_stream(stream_ai_response(history, image_data is not None)):
                             chunk_data = {
                                 "type": "stream",
-                                "content": chunk,
+                                "content": text,
                             }
-                            await manager.send_message(json.dumps(chunk_data), client_id)
-                            complete_response += chunk
-                        
+                            await manager.send_message(orjson.dumps(chunk_data).decode(), client_id)
+                            parts.append(text)
+                        complete_response = "".join(parts)
+
                         # Add the complete response to chat history
-                        chat_sessions[client_id].messages.append(
-                            Message(role="assistant", content=complete_response)
+                        await save_message(
+                            client_id, history, {"role": "assistant", "content": complete_response}
                         )
 
                         # Send complete message signal with metadata
-                        response_time = time.time() - start_time
+                        response_time = time.perf_counter() - start_time
                         complete_data = {
                             "type": "stream_complete",
-                            "metadata": {
-                                "response_time": response_time,
-                                "length": len(complete_response),
-                                "sentiment": analyze_sentiment(complete_response),
-                                "contains_image_analysis": image_data is not None,
-                            },
+                            "metadata": build_response_metadata(response_time, complete_response, image_data is not None),
                         }
-                        await manager.send_message(json.dumps(complete_data), client_id)
+                        await manager.send_message(orjson.dumps(complete_data).decode(), client_id)
 
                 except Exception as e:
                     # Handle API errors
@@ -181,7 +367,7 @@ async def websocket_endpoint(websocket: WebSocket, client_id: str):
                         "type": "error",
                         "content": f"Error: {str(e)}",
                     }
-                    await manager.send_message(json.dumps(error_data), client_id)
+                    await manager.send_message(orjson.dumps(error_data).decode(), client_id)
 
             # Handle feedback messages
             elif message_data.get("type") == "feedback":
@@ -195,35 +381,34 @@ async def websocket_endpoint(websocket: WebSocket, client_id: str):
                 print(f"Received feedback: {feedback_data}")
 
                 # Acknowledge feedback receipt
-                await manager.send_message(json.dumps({"type": "feedback_received"}), client_id)
+                await manager.send_message(FEEDBACK_RECEIVED_FRAME, client_id)
 
     except WebSocketDisconnect:
-        manager.disconnect(client_id)
+        manager.disconnect(client_id, websocket)
     except Exception as e:
         print(f"Error in websocket connection: {str(e)}")
-        manager.disconnect(client_id)
-
-
-async def get_ai_response(messages: List[Message], has_image: bool = False):
+        manager.disconnect(client_id, websocket)
+    finally:
+        # With Redis the session is kept there, so drop the in-memory copy,
+        # unless a newer connection for the same client is still using it
+        if (
+            redis_client is not None
+            and session is not None
+            and chat_sessions.get(client_id) is session
+            and client_id not in manager.active_connections
+        ):
+            del chat_sessions[client_id]
+
+
+async def get_ai_response(messages: List[Dict], has_image: bool = False):
     """Get a response from OpenAI API (non-streaming)"""
     try:
-        # Convert messages to the format OpenAI expects
-        openai_messages = []
-        
-        for m in messages:
-            # For text messages
-            if isinstance(m.content, str):
-                openai_messages.append({"role": m.role, "content": m.content})
-            # For messages with image content
-            elif isinstance(m.content, list):
-                openai_messages.append({"role": m.role, "content": m.content})
-
         # For image analysis, use GPT-4o which supports vision capabilities
         model = "gpt-4o"
 
         response = await client.chat.completions.create(
             model=model,
-            messages=openai_messages,
+            messages=messages,
             max_tokens=1000,
         )
 
@@ -232,20 +417,9 @@ async def get_ai_response(messages: List[Message], has_image: bool = False):
         print(f"Error calling OpenAI API: {str(e)}")
         raise HTTPException(status_code=500, detail=f"Error calling AI service: {str(e)}")
 
-async def stream_ai_response(messages: List[Message], has_image: bool = False):
+async def stream_ai_response(messages: List[Dict], has_image: bool = False):
     """Stream a response from OpenAI API"""
     try:
-        # Convert our messages to the format OpenAI expects
-        openai_messages = []
-        
-        for m in messages:
-            # For text messages
-            if isinstance(m.content, str):
-                openai_messages.append({"role": m.role, "content": m.content})
-            # For messages with image content
-            elif isinstance(m.content, list):
-                openai_messages.append({"role": m.role, "content": m.content})
-
         # For image analysis, use GPT-4o which supports vision capabilities
         model = "gpt-4o"
         
@@ -254,7 +428,7 @@ async def stream_ai_response(messages: List[Message], has_image: bool = False):
             # Vision model may not support streaming, so we'll simulate it
             response = await client.chat.completions.create(
                 model=model,
-                messages=openai_messages,
+                messages=messages,
                 max_tokens=1000,
             )
             
@@ -267,7 +441,7 @@ async def stream_ai_response(messages: List[Message], has_image: bool = False):
         else:
             stream = await client.chat.completions.create(
                 model=model,
-                messages=openai_messages,
+                messages=messages,
                 stream=True,
                 max_tokens=1000,
             )
@@ -280,6 +454,57 @@ async def stream_ai_response(messages: List[Message], has_image: bool = False):
         print(f"Error streaming from OpenAI API: {str(e)}")
         raise HTTPException(status_code=500, detail=f"Error streaming from AI service: {str(e)}")
 
+async def buffered_stream(
+    chunks, interval: float = STREAM_FLUSH_INTERVAL, max_size: int = STREAM_FLUSH_SIZE
+):
+    """
+    Coalesce an async stream of text deltas into larger pieces.
+
+    Buffered text is yielded once it reaches `max_size` characters or `interval`
+    seconds after the first delta went into the buffer, so the client still sees
+    steady progress while receiving far fewer frames. The next delta is only
+    requested once the consumer is done with the previous piece, so a slow send
+    throttles the upstream stream.
+    """
+    loop = asyncio.get_running_loop()
+    buffer = StreamBuffer(max_size)
+    stream_iter = chunks.__aiter__()
+    pending = None
+    deadline = None
+    try:
+        while True:
+            if pending is None:
+                pending = asyncio.ensure_future(stream_iter.__anext__())
+            timeout = None if deadline is None else max(deadline - loop.time(), 0)
+            try:
+                # Shield the pending read so a timed flush doesn't cancel it
+                chunk = await asyncio.wait_for(asyncio.shield(pending), timeout)
+            except asyncio.TimeoutError:
+                deadline = None
+                yield buffer.drain()
+                continue
+            except StopAsyncIteration:
+                break
+            except Exception:
+                # Deliver what was received before the upstream error
+                if buffer:
+                    yield buffer.drain()
+                raise
+            pending = None
+
+            buffer.append(chunk)
+            if deadline is None:
+                deadline = loop.time() + interval
+            if buffer.is_full():
+                deadline = None
+                yield buffer.drain()
+
+        if buffer:
+            yield buffer.drain()
+    finally:
+        if pending is not None and not pending.done():
+            pending.cancel()
+
 def analyze_sentiment(text: str) -> str:
     """
     Analyze sentiment using VADER sentiment analysis tool.
@@ -287,6 +512,10 @@ def analyze_sentiment(text: str) -> str:
     
     If VADER is not available, falls back to the simple keyword-based method.
     """
+    # Nothing to score in an empty or whitespace-only reply
+    if not text or text.isspace():
+        return "neutral"
+
     # Check if VADER sentiment analyzer is available
     if sentiment_analyzer is not None:
         # Get sentiment scores
@@ -306,34 +535,27 @@ def analyze_sentiment(text: str) -> str:
         # Fallback to simple keyword-based method
         return simple_sentiment_analysis(text)
 
+# Keywords for the fallback sentiment analysis, compiled into one pattern so
+# both polarities are counted in a single scan of the reply
+SENTIMENT_WORDS_RE = re.compile(
+    r"\b(?:"
+    r"(?P<positive>happy|good|great|excellent|positive|wonderful|amazing|love)"
+    r"|(?P<negative>sad|bad|terrible|poor|negative|awful|hate)"
+    r")\b",
+    re.IGNORECASE,
+)
+
 def simple_sentiment_analysis(text: str) -> str:
     """
     Simple estimation of sentiment based on keywords.
     """
-    positive_words = [
-        "happy",
-        "good",
-        "great",
-        "excellent",
-        "positive",
-        "wonderful",
-        "amazing",
-        "love",
-    ]
-    negative_words = [
-        "sad",
-        "bad",
-        "terrible",
-        "poor",
-        "negative",
-        "awful",
-        "hate",
-    ]
-
-    text = text.lower()
-
-    positive_count = sum(1 for word in positive_words if word in text)
-    negative_count = sum(1 for word in negative_words if word in text)
+    positive_count = 0
+    negative_count = 0
+    for match in SENTIMENT_WORDS_RE.finditer(text):
+        if match.lastgroup == "positive":
+            positive_count += 1
+        else:
+            negative_count += 1
 
     if positive_count > negative_count:
         return "positive"
@@ -342,14 +564,24 @@ def simple_sentiment_analysis(text: str) -> str:
     else:
         return "neutral"
 
+def build_response_metadata(response_time: float, text: str, has_image: bool) -> Dict:
+    """Build the metadata sent alongside a complete AI response."""
+    return {
+        "response_time": response_time,
+        "length": len(text),
+        "sentiment": analyze_sentiment(text),
+        "contains_image_analysis": has_image,
+    }
+
 
 @router.get("/sessions/{client_id}")
 async def get_chat_history(client_id: str):
     """Get chat history for a specific client"""
-    if client_id not in chat_sessions:
+    session = await load_session(client_id)
+    if session is None:
         raise HTTPException(status_code=404, detail="Chat session not found")
 
-    return chat_sessions[client_id]
+    return session
 
 
 @router.delete("/sessions/{client_id}")
@@ -357,5 +589,7 @@ async def delete_chat_session(client_id: str):
     """Delete a chat session"""
     if client_id in chat_sessions:
         del chat_sessions[client_id]
+    if redis_client is not None:
+        await redis_client.delete(session_key(client_id))
 
     return JSONResponse(content={"status": "success", "message": "Chat session deleted"})
\ No newline at end of file
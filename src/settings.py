@@ -1,4 +1,4 @@
-from typing import Literal
+from typing import Literal, Optional
 
 from pydantic_settings import BaseSettings, SettingsConfigDict
 
@@ -8,6 +8,8 @@ class Settings(BaseSettings):
     API_VERSION: str
     API_DESCRIPTION: str
     LOGGING_LEVEL: Literal["DEBUG", "INFO", "WARNING", "ERROR", "CRITICAL"]
+    REDIS_URL: Optional[str] = None
+    REDIS_BROADCAST: bool = False
 
 
 settings = Settings()
@@ -2,6 +2,8 @@ import logging
 import sqlite3
 from contextlib import asynccontextmanager
 
+import httpx
+import redis.asyncio as redis
 from fastapi import FastAPI
 
 from src.settings import settings
@@ -13,6 +15,22 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+# Shared HTTP client for outbound API calls (OpenAI). The pool is sized for many
+# concurrent WebSocket clients and HTTP/2 lets their requests share a few TLS
+# connections instead of opening one per turn.
+http_client = httpx.AsyncClient(
+    limits=httpx.Limits(
+        max_connections=500,
+        max_keepalive_connections=200,
+        keepalive_expiry=30,
+    ),
+    http2=True,
+    timeout=httpx.Timeout(60.0, connect=5.0),
+)
+
+# Redis is optional; when configured it lets multiple workers share state
+redis_client = redis.from_url(settings.REDIS_URL) if settings.REDIS_URL else None
+
 
 @asynccontextmanager
 async def app_resources_lifespan(app: FastAPI):
@@ -20,4 +38,9 @@ async def app_resources_lifespan(app: FastAPI):
         yield
     finally:
         # Cleanup resources
+        await http_client.aclose()
+        logger.info("HTTP client closed.")
+        if redis_client is not None:
+            await redis_client.aclose()
+            logger.info("Redis connection closed.")
         logger.info("Database connection closed.")
@@ -0,0 +1,51 @@
+import asyncio
+
+import pytest
+
+from src.routes.v1.endpoints import buffered_stream
+
+
+async def deltas(parts, delay=0.0):
+    for part in parts:
+        if delay:
+            await asyncio.sleep(delay)
+        yield part
+
+
+async def collect(stream):
+    return [piece async for piece in stream]
+
+
+@pytest.mark.asyncio
+async def test_fast_deltas_are_coalesced_into_one_piece():
+    pieces = await collect(buffered_stream(deltas(["a", "b", "c"]), interval=1))
+
+    assert pieces == ["abc"]
+
+
+@pytest.mark.asyncio
+async def test_buffer_is_flushed_once_full():
+    pieces = await collect(buffered_stream(deltas(["ab", "cd", "ef"]), interval=1, max_size=4))
+
+    assert pieces == ["abcd", "ef"]
+
+
+@pytest.mark.asyncio
+async def test_buffer_is_flushed_after_interval():
+    pieces = await collect(buffered_stream(deltas(["a", "b", "c"], delay=0.05), interval=0.01))
+
+    assert pieces == ["a", "b", "c"]
+
+
+@pytest.mark.asyncio
+async def test_buffered_text_is_sent_before_upstream_error():
+    async def failing():
+        yield "a"
+        raise RuntimeError("upstream failed")
+
+    received = []
+    with pytest.raises(RuntimeError, match="upstream failed"):
+        async for piece in buffered_stream(failing(), interval=1):
+            received.append(piece)
+
+    assert received == ["a"]
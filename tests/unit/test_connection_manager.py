@@ -0,0 +1,161 @@
+import asyncio
+
+import pytest
+
+from src.routes.v1.endpoints import SEND_QUEUE_SIZE, ConnectionManager
+
+
+class FakeWebSocket:
+    """Records sent frames; sends block while `blocked` is set"""
+
+    def __init__(self, blocked: bool = False):
+        self.sent = []
+        self.unblocked = asyncio.Event()
+        if not blocked:
+            self.unblocked.set()
+
+    async def accept(self):
+        pass
+
+    async def send_text(self, message: str):
+        await self.unblocked.wait()
+        self.sent.append(message)
+
+
+async def settle():
+    # Let the writer tasks drain their queues
+    for _ in range(5):
+        await asyncio.sleep(0)
+
+
+@pytest.mark.asyncio
+async def test_messages_are_sent_in_order():
+    manager = ConnectionManager()
+    websocket = FakeWebSocket()
+    await manager.connect(websocket, "a")
+
+    for i in range(10):
+        await manager.send_message(str(i), "a")
+    await settle()
+
+    assert websocket.sent == [str(i) for i in range(10)]
+    manager.disconnect("a", websocket)
+
+
+@pytest.mark.asyncio
+async def test_old_connection_closing_keeps_reconnected_client():
+    manager = ConnectionManager()
+    old, new = FakeWebSocket(), FakeWebSocket()
+    await manager.connect(old, "a")
+    await manager.connect(new, "a")
+
+    manager.disconnect("a", old)
+    await manager.send_message("hello", "a")
+    await settle()
+
+    assert manager.active_connections["a"] is new
+    assert new.sent == ["hello"]
+    manager.disconnect("a", new)
+    assert "a" not in manager.active_connections
+
+
+@pytest.mark.asyncio
+async def test_reconnect_releases_producer_blocked_on_old_queue():
+    manager = ConnectionManager()
+    old, new = FakeWebSocket(blocked=True), FakeWebSocket()
+    await manager.connect(old, "a")
+
+    async def produce():
+        # More than the queue holds, so this blocks while `old` isn't reading
+        for i in range(SEND_QUEUE_SIZE + 5):
+            await manager.send_message(str(i), "a")
+
+    producer = asyncio.create_task(produce())
+    await settle()
+    assert not producer.done()
+
+    await manager.connect(new, "a")
+    await asyncio.wait_for(producer, timeout=1)
+    manager.disconnect("a", new)
+
+
+@pytest.mark.asyncio
+async def test_broadcast_is_not_blocked_by_a_stalled_client():
+    manager = ConnectionManager()
+    stalled, healthy = FakeWebSocket(blocked=True), FakeWebSocket()
+    await manager.connect(stalled, "stalled")
+    await manager.connect(healthy, "healthy")
+    # Fill the stalled client's queue (its writer holds one more in flight)
+    for i in range(SEND_QUEUE_SIZE + 1):
+        await manager.send_message(str(i), "stalled")
+
+    await asyncio.wait_for(manager.broadcast({"type": "notice"}), timeout=1)
+    await settle()
+
+    assert healthy.sent == ['{"type":"notice"}']
+    manager.disconnect("stalled", stalled)
+    manager.disconnect("healthy", healthy)
+
+
+class FlakyPubSub:
+    """Fails on the first subscription, then delivers the published messages"""
+
+    attempts = 0
+
+    def __init__(self, messages):
+        self.messages = messages
+
+    async def __aenter__(self):
+        FlakyPubSub.attempts += 1
+        if FlakyPubSub.attempts == 1:
+            raise ConnectionError("redis unavailable")
+        return self
+
+    async def __aexit__(self, *exc_info):
+        pass
+
+    async def subscribe(self, channel):
+        pass
+
+    async def listen(self):
+        for message in self.messages:
+            yield {"type": "message", "data": message.encode()}
+        await asyncio.Event().wait()
+
+
+@pytest.mark.asyncio
+async def test_relay_resubscribes_after_failure(monkeypatch):
+    from src.routes.v1 import endpoints
+
+    redis = type("FakeRedis", (), {"pubsub": lambda self: FlakyPubSub(["hello"])})()
+    monkeypatch.setattr(endpoints, "redis_client", redis)
+    monkeypatch.setattr(endpoints, "BROADCAST_RELAY", True)
+    monkeypatch.setattr(endpoints, "RELAY_RETRY_DELAY", 0)
+    manager = ConnectionManager()
+    websocket = FakeWebSocket()
+    await manager.connect(websocket, "a")
+
+    for _ in range(20):
+        await asyncio.sleep(0)
+
+    assert FlakyPubSub.attempts == 2
+    assert websocket.sent == ["hello"]
+    manager.disconnect("a", websocket)
+    assert manager.relay_task is None
+
+
+@pytest.mark.asyncio
+async def test_relay_is_not_started_unless_enabled(monkeypatch):
+    from src.routes.v1 import endpoints
+
+    monkeypatch.setattr(endpoints, "redis_client", object())
+    monkeypatch.setattr(endpoints, "BROADCAST_RELAY", False)
+    manager = ConnectionManager()
+    websocket = FakeWebSocket()
+    await manager.connect(websocket, "a")
+    await manager.broadcast("hello")
+    await settle()
+
+    assert manager.relay_task is None
+    assert websocket.sent == ["hello"]
+    manager.disconnect("a", websocket)
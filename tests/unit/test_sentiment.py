@@ -0,0 +1,25 @@
+from src.routes.v1.endpoints import analyze_sentiment, simple_sentiment_analysis
+
+
+def test_keywords_are_matched_case_insensitively():
+    assert simple_sentiment_analysis("What a GREAT idea") == "positive"
+    assert simple_sentiment_analysis("That is Awful") == "negative"
+
+
+def test_every_occurrence_is_counted():
+    assert simple_sentiment_analysis("good, good, but bad") == "positive"
+    assert simple_sentiment_analysis("good, but bad and sad") == "negative"
+
+
+def test_only_whole_words_are_matched():
+    assert simple_sentiment_analysis("goodbye, badge holder") == "neutral"
+
+
+def test_text_without_keywords_is_neutral():
+    assert simple_sentiment_analysis("The meeting is at noon.") == "neutral"
+    assert simple_sentiment_analysis("") == "neutral"
+
+
+def test_empty_reply_is_neutral():
+    assert analyze_sentiment("") == "neutral"
+    assert analyze_sentiment("  \n") == "neutral"
@@ -0,0 +1,32 @@
+from src.routes.v1.endpoints import MAX_HISTORY, append_message
+
+
+def user(i):
+    return {"role": "user", "content": str(i)}
+
+
+def test_history_below_limit_is_kept():
+    messages = []
+    for i in range(MAX_HISTORY):
+        append_message(messages, user(i))
+
+    assert messages == [user(i) for i in range(MAX_HISTORY)]
+
+
+def test_oldest_messages_are_dropped_beyond_limit():
+    messages = []
+    for i in range(MAX_HISTORY + 5):
+        append_message(messages, user(i))
+
+    assert messages == [user(i) for i in range(5, MAX_HISTORY + 5)]
+
+
+def test_leading_system_message_is_kept():
+    system = {"role": "system", "content": "Be brief"}
+    messages = [system]
+    for i in range(MAX_HISTORY + 5):
+        append_message(messages, user(i))
+
+    assert len(messages) == MAX_HISTORY
+    assert messages[0] == system
+    assert messages[1:] == [user(i) for i in range(6, MAX_HISTORY + 5)]
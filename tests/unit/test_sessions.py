@@ -0,0 +1,96 @@
+import asyncio
+
+import pytest
+from fastapi.testclient import TestClient
+
+from src.main import application
+from src.routes.v1 import endpoints
+
+
+class FakePipeline:
+    def __init__(self, error=None):
+        self.error = error
+
+    def rpush(self, *args):
+        return self
+
+    def ltrim(self, *args):
+        return self
+
+    def expire(self, *args):
+        return self
+
+    async def execute(self):
+        if self.error is not None:
+            raise self.error
+
+
+class FakePubSub:
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        pass
+
+    async def subscribe(self, channel):
+        pass
+
+    async def listen(self):
+        await asyncio.Event().wait()
+        yield
+
+
+class FakeRedis:
+    """Redis stand-in whose reads or writes can be made to fail"""
+
+    def __init__(self, read_error=None, write_error=None):
+        self.read_error = read_error
+        self.write_error = write_error
+
+    async def lrange(self, *args):
+        if self.read_error is not None:
+            raise self.read_error
+        return []
+
+    def pipeline(self, transaction=True):
+        return FakePipeline(self.write_error)
+
+    def pubsub(self):
+        return FakePubSub()
+
+
+@pytest.mark.asyncio
+async def test_failed_redis_write_leaves_history_unchanged(monkeypatch):
+    monkeypatch.setattr(endpoints, "redis_client", FakeRedis(write_error=ConnectionError("down")))
+    history = []
+
+    with pytest.raises(ConnectionError):
+        await endpoints.save_message("a", history, {"role": "user", "content": "hi"})
+
+    assert history == []
+
+
+def test_failed_session_load_releases_the_connection(monkeypatch):
+    monkeypatch.setattr(endpoints, "redis_client", FakeRedis(read_error=ConnectionError("down")))
+
+    # Leaving the block waits for the handler, which gives up on the failed load
+    with TestClient(application).websocket_connect("/ws/load-fails"):
+        pass
+
+    assert "load-fails" not in endpoints.manager.active_connections
+    assert "load-fails" not in endpoints.manager.send_queues
+    assert "load-fails" not in endpoints.manager.writer_tasks
+    assert endpoints.manager.relay_task is None
+
+
+def test_failed_message_save_sends_error_and_keeps_connection(monkeypatch):
+    monkeypatch.setattr(endpoints, "redis_client", FakeRedis(write_error=ConnectionError("down")))
+
+    with TestClient(application).websocket_connect("/ws/save-fails") as websocket:
+        websocket.send_json({"type": "message", "content": "hi"})
+        error = websocket.receive_json()
+        assert error["type"] == "error"
+        assert endpoints.chat_sessions["save-fails"].messages == []
+
+        websocket.send_json({"type": "feedback", "rating": 1})
+        assert websocket.receive_json() == {"type": "feedback_received"}